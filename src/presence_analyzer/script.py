@@ -30,6 +30,10 @@ def make_app(global_conf={}, config=DEPLOY_CFG, debug=False):
     from presence_analyzer import app
     app.config.from_pyfile(abspath(config))
     app.debug = debug
+    if app.config.get('PARALLEL_PARSE'):
+        # parse data in worker processes before server threads are started
+        from presence_analyzer.utils import get_data
+        get_data()
     return app
 
 
@@ -1,8 +1,10 @@
 # -*- coding: utf-8 -*-
 """Presence analyzer unit tests."""
-import os.path
+import os
 import json
+import shutil
 import datetime
+import tempfile
 import unittest
 import httplib
 
@@ -110,6 +112,131 @@ class PresenceAnalyzerViewsTestCase(unittest.TestCase):
         self.assertEqual(resp.status_code, httplib.OK)
         self.assertListEqual(data, proper_data)
 
+    def test_cached_response(self):
+        """Test reusing response body of user view."""
+        cache = utils._RESPONSE_CACHE['presence_weekday_view']
+        cache.clear()
+
+        first = self.client.get('/api/v1/presence_weekday/10')
+        second = self.client.get('/api/v1/presence_weekday/10')
+
+        self.assertEqual(len(cache), 1)
+        self.assertEqual(second.status_code, httplib.OK)
+        self.assertEqual(second.content_type, 'application/json')
+        self.assertEqual(first.data, second.data)
+
+    def test_conditional_response(self):
+        """Test answering conditional requests with 304 Not Modified."""
+        resp = self.client.get('/api/v1/presence_start_end/10')
+        etag = resp.headers['ETag']
+
+        self.assertEqual(resp.status_code, httplib.OK)
+        self.assertIn('Last-Modified', resp.headers)
+        self.assertNotEqual(
+            etag,
+            self.client.get('/api/v1/presence_start_end/11').headers['ETag'],
+        )
+
+        resp = self.client.get(
+            '/api/v1/presence_start_end/10',
+            headers={'If-None-Match': etag},
+        )
+        self.assertEqual(resp.status_code, httplib.NOT_MODIFIED)
+        self.assertEqual(resp.data, '')
+
+        resp = self.client.get(
+            '/api/v1/presence_start_end/10',
+            headers={'If-None-Match': '"0-10"'},
+        )
+        self.assertEqual(resp.status_code, httplib.OK)
+
+    def test_precomputed_response(self):
+        """Test serving user view from precomputed JSON file."""
+        directory = tempfile.mkdtemp()
+        main.app.config['JSON_CACHE_DIR'] = directory
+        try:
+            resp = self.client.get('/api/v1/mean_time_weekday/11')
+            path = os.path.join(directory, 'mean_time_weekday_view', '11.json')
+
+            self.assertEqual(resp.status_code, httplib.OK)
+            self.assertEqual(resp.content_type, 'application/json')
+            with open(path) as json_file:
+                self.assertEqual(json_file.read(), resp.data)
+            self.assertTrue(
+                os.path.isfile(
+                    os.path.join(directory, 'presence_weekday_view', '10.json')
+                )
+            )
+            self.assertEqual(
+                self.client.get('/api/v1/mean_time_weekday/12').status_code,
+                httplib.NOT_FOUND,
+            )
+            resp.close()
+        finally:
+            main.app.config['JSON_CACHE_DIR'] = None
+            shutil.rmtree(directory)
+
+    def test_precomputed_response_headers(self):
+        """Test caching headers of view served from precomputed file."""
+        headers = ('Cache-Control', 'Expires', 'ETag', 'Last-Modified')
+        resp = self.client.get('/api/v1/presence_weekday/10')
+        expected = [resp.headers.get(header) for header in headers]
+
+        directory = tempfile.mkdtemp()
+        main.app.config['JSON_CACHE_DIR'] = directory
+        try:
+            resp = self.client.get('/api/v1/presence_weekday/10')
+            resp.close()
+        finally:
+            main.app.config['JSON_CACHE_DIR'] = None
+            shutil.rmtree(directory)
+
+        self.assertEqual(
+            [resp.headers.get(header) for header in headers], expected,
+        )
+        self.assertIsNone(resp.headers.get('Cache-Control'))
+        self.assertIsNone(resp.headers.get('Expires'))
+
+    def test_precomputed_response_refresh(self):
+        """Test rewriting precomputed JSON files when they are outdated."""
+        first, second = tempfile.mkdtemp(), tempfile.mkdtemp()
+        view_directory = os.path.join(second, 'presence_weekday_view')
+        os.makedirs(view_directory)
+        with open(os.path.join(view_directory, '99.json'), 'w') as stale:
+            stale.write('[]')
+        try:
+            main.app.config['JSON_CACHE_DIR'] = first
+            self.client.get('/api/v1/presence_weekday/10').close()
+
+            main.app.config['JSON_CACHE_DIR'] = second
+            self.client.get('/api/v1/presence_weekday/10').close()
+            self.assertItemsEqual(
+                os.listdir(view_directory), ['10.json', '11.json'],
+            )
+
+            shutil.rmtree(view_directory)
+            resp = self.client.get('/api/v1/presence_weekday/11')
+            resp.close()
+            self.assertEqual(resp.status_code, httplib.OK)
+            self.assertItemsEqual(
+                os.listdir(view_directory), ['10.json', '11.json'],
+            )
+        finally:
+            main.app.config['JSON_CACHE_DIR'] = None
+            shutil.rmtree(first)
+            shutil.rmtree(second)
+
+    def test_precomputed_response_error(self):
+        """Test falling back to view when JSON files cannot be written."""
+        main.app.config['JSON_CACHE_DIR'] = os.path.join(TEST_DATA_CSV, 'x')
+        try:
+            resp = self.client.get('/api/v1/presence_weekday/10')
+        finally:
+            main.app.config['JSON_CACHE_DIR'] = None
+
+        self.assertEqual(resp.status_code, httplib.OK)
+        self.assertEqual(json.loads(resp.data)[2], ['Tue', 30047])
+
 
 class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
     """Utility functions tests."""
@@ -136,6 +263,192 @@ class PresenceAnalyzerUtilsTestCase(unittest.TestCase):
             datetime.time(9, 39, 5)
         )
 
+    def test_get_data_cache(self):
+        """Test reusing parsed data until CSV file is modified."""
+        data = utils.get_data()
+        self.assertIs(data, utils.get_data())
+
+        mtime = os.path.getmtime(TEST_DATA_CSV)
+        os.utime(TEST_DATA_CSV, (mtime, mtime + 1))
+        try:
+            self.assertIsNot(data, utils.get_data())
+            self.assertEqual(data, utils.get_data())
+        finally:
+            os.utime(TEST_DATA_CSV, (mtime, mtime))
+
+    def test_read_range(self):
+        """Test reading lines which start within byte range."""
+        with open(TEST_DATA_CSV, 'r') as csvfile:
+            lines = csvfile.readlines()
+        size = os.path.getsize(TEST_DATA_CSV)
+        middle = len(lines[0]) + 1
+
+        self.assertEqual(utils.read_range(TEST_DATA_CSV, 0, size), lines)
+        self.assertEqual(
+            utils.read_range(TEST_DATA_CSV, 0, middle),
+            lines[:2],
+        )
+        self.assertEqual(
+            utils.read_range(TEST_DATA_CSV, middle, size),
+            lines[2:],
+        )
+        self.assertEqual(
+            utils.read_range(TEST_DATA_CSV, len(lines[0]), size),
+            lines[1:],
+        )
+
+    def test_split_ranges(self):
+        """Test splitting file into byte ranges of whole lines."""
+        with open(TEST_DATA_CSV, 'r') as csvfile:
+            lines = csvfile.readlines()
+        ranges = utils.split_ranges(TEST_DATA_CSV, 3)
+
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(TEST_DATA_CSV))
+        for (_, high, _), (low, _, first_line) in zip(ranges, ranges[1:]):
+            self.assertEqual(high, low)
+            self.assertEqual(len(''.join(lines[:first_line])), low)
+
+    def test_parse_parallel(self):
+        """Test parsing CSV file in worker processes."""
+        self.assertEqual(
+            utils.parse_parallel(TEST_DATA_CSV, processes=3),
+            utils.get_data(),
+        )
+
+    def test_parallel_parse_in_request(self):
+        """Test parsing CSV file serially while serving request."""
+        def parse_parallel(path):
+            """Fails when called."""
+            self.fail('parse_parallel called for {0}'.format(path))
+
+        original = utils.parse_parallel
+        utils.parse_parallel = parse_parallel
+        main.app.config['PARALLEL_PARSE'] = True
+        try:
+            utils._CACHE.clear()
+            with main.app.test_request_context():
+                data = utils.get_data()
+            self.assertItemsEqual(data.keys(), [10, 11])
+        finally:
+            main.app.config['PARALLEL_PARSE'] = False
+            utils.parse_parallel = original
+
+    def test_get_stats(self):
+        """Test precomputing presence statistics of every user."""
+        stats = utils.get_stats()
+
+        self.assertItemsEqual(stats.keys(), [10, 11])
+        self.assertEqual(
+            stats[10]['weekday'], [0, 30047, 24465, 23705, 0, 0, 0],
+        )
+        self.assertEqual(
+            stats[10]['mean_weekday'],
+            [0, 30047.0, 24465.0, 23705.0, 0, 0, 0],
+        )
+        self.assertEqual(
+            stats[10]['start_end'],
+            utils.group_by_start_end_time(utils.get_data()[10]),
+        )
+        self.assertIs(stats, utils.get_stats())
+
+    def test_get_users_json(self):
+        """Test serializing users listing."""
+        users_json = utils.get_users_json()
+
+        self.assertEqual(
+            json.loads(users_json),
+            [
+                {u'user_id': 10, u'name': u'User 10'},
+                {u'user_id': 11, u'name': u'User 11'},
+            ],
+        )
+        self.assertIs(users_json, utils.get_users_json())
+
+    def test_aggregate_user(self):
+        """Test aggregating user presence by weekday in a single pass."""
+        data = utils.get_data()
+        self.assertEqual(
+            utils.aggregate_user(data[10]),
+            {
+                'sums': [0, 30047, 24465, 23705, 0, 0, 0],
+                'starts': [0, 34745, 33592, 38926, 0, 0, 0],
+                'ends': [0, 64792, 58057, 62631, 0, 0, 0],
+                'counts': [0, 1, 1, 1, 0, 0, 0],
+            },
+        )
+
+    def test_means(self):
+        """Test dividing totals by counts."""
+        self.assertEqual(utils.means([0, 3, 5], [0, 2, 1]), [0, 1.5, 5.0])
+
+    def test_parse_date(self):
+        """Test parsing date in YYYY-MM-DD format."""
+        for text in ('2013-09-10', '2013-9-10'):
+            self.assertEqual(
+                utils.parse_date(text), datetime.date(2013, 9, 10),
+            )
+        for text in (
+                '2013-09-1 ', '2013-+1-10', '2013-009-10', '13-09-10',
+                '2013-02-30', '2013/09/10', 'date', '',
+        ):
+            self.assertRaises(ValueError, utils.parse_date, text)
+
+    def test_parse_seconds(self):
+        """Test parsing time in HH:MM:SS format into seconds."""
+        self.assertEqual(utils.parse_seconds('00:00:00'), 0)
+        self.assertEqual(utils.parse_seconds('09:39:05'), 34745)
+        self.assertEqual(utils.parse_seconds('23:59:59'), 86399)
+        self.assertEqual(utils.parse_seconds('9:0:5'), 32405)
+        for text in (
+                '24:00:00', '12:60:00', '12:00', '12:00:-1', 'time',
+                ' 9:00:00', '+9:00:00', '09:00:00 ', '009:00:00',
+                '-0:00:00', '12:00:00:00', '',
+        ):
+            self.assertRaises(ValueError, utils.parse_seconds, text)
+
+    def test_user_presence(self):
+        """Test mapping interface of user presence arrays."""
+        items = utils.UserPresence([
+            (datetime.date(2013, 9, 11), 3600, 7200),
+            (datetime.date(2013, 9, 10), 0, 59),
+        ])
+
+        self.assertEqual(len(items), 2)
+        self.assertEqual(
+            list(items),
+            [datetime.date(2013, 9, 10), datetime.date(2013, 9, 11)],
+        )
+        self.assertEqual(list(items.weekdays), [1, 2])
+        self.assertEqual(
+            items[datetime.date(2013, 9, 11)],
+            {'start': datetime.time(1, 0, 0), 'end': datetime.time(2, 0, 0)},
+        )
+        self.assertNotIn(datetime.date(2013, 9, 12), items)
+        self.assertNotIn(datetime.date(2013, 9, 1), items)
+        self.assertNotIn(None, items)
+        self.assertIsNone(items.get('x'))
+
+    def test_seconds_to_time(self):
+        """Test converting amount of seconds since midnight to time."""
+        self.assertEqual(utils.seconds_to_time(0), datetime.time(0, 0, 0))
+        self.assertEqual(utils.seconds_to_time(3661), datetime.time(1, 1, 1))
+        self.assertEqual(
+            utils.seconds_to_time(86399), datetime.time(23, 59, 59),
+        )
+
+    def test_get_data_mtime(self):
+        """Test reading modification time of CSV file once per request."""
+        mtime = os.path.getmtime(TEST_DATA_CSV)
+        self.assertEqual(utils.get_data_mtime(), mtime)
+        with main.app.test_request_context():
+            self.assertEqual(utils.get_data_mtime(), mtime)
+            os.utime(TEST_DATA_CSV, (mtime, mtime + 1))
+            try:
+                self.assertEqual(utils.get_data_mtime(), mtime)
+            finally:
+                os.utime(TEST_DATA_CSV, (mtime, mtime))
+
     def test_seconds_since_midnight(self):
         """Test calculating the amount of seconds since midnight."""
         self.assertEqual(
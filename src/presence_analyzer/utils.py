@@ -1,18 +1,45 @@
 # -*- coding: utf-8 -*-
 """Helper functions used in views."""
 
+import os
 import csv
-from json import dumps
+import tempfile
+import threading
+import multiprocessing
+from json import JSONEncoder
+from array import array
+from bisect import bisect_left
+from itertools import izip
 from functools import wraps
-from datetime import datetime
+from collections import Mapping, OrderedDict
+from datetime import datetime, date, timedelta
 
-from flask import Response
+from flask import (
+    Response,
+    g,
+    request,
+    send_file,
+    has_request_context,
+)
 
 from presence_analyzer.main import app
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+_CACHE = {}
+_CACHE_LOCK = threading.RLock()
+
+RESPONSE_CACHE_SIZE = 256
+_RESPONSE_CACHE = {}
+_RESPONSE_CACHE_LOCK = threading.Lock()
+
+_PRECOMPUTED = {}
+_EXPORTED = {}
+
+# reused for every response, compact separators keep payloads small
+_JSON_ENCODER = JSONEncoder(separators=(',', ':'))
+
 
 def jsonify(function):
     """Creates a response with the JSON representation
@@ -22,17 +49,173 @@ def jsonify(function):
     def inner(*args, **kwargs):
         """This docstring will be overridden by @wraps decorator."""
         return Response(
-            dumps(function(*args, **kwargs)),
+            _JSON_ENCODER.encode(function(*args, **kwargs)),
             mimetype='application/json'
         )
     return inner
 
 
+def get_data_mtime():
+    """Returns modification time of DATA_CSV file. It is read once per
+    request, so all layers of a view see the same version of the file.
+    """
+    if not has_request_context():
+        return os.path.getmtime(app.config['DATA_CSV'])
+    mtime = getattr(g, 'data_mtime', None)
+    if mtime is None:
+        mtime = g.data_mtime = os.path.getmtime(app.config['DATA_CSV'])
+    return mtime
+
+
+def cache_response(function):
+    """Memoizes body of wrapped user view until DATA_CSV file changes.
+    Least recently used bodies are dropped when there are more than
+    RESPONSE_CACHE_SIZE of them for given view.
+    """
+    cache = _RESPONSE_CACHE.setdefault(function.__name__, OrderedDict())
+
+    @wraps(function)
+    def inner(user_id):
+        """This docstring will be overridden by @wraps decorator."""
+        key = (user_id, app.config['DATA_CSV'], get_data_mtime())
+        with _RESPONSE_CACHE_LOCK:
+            body = cache.pop(key, None)
+            if body is not None:
+                cache[key] = body
+        if body is None:
+            body = function(user_id).get_data()
+            with _RESPONSE_CACHE_LOCK:
+                cache[key] = body
+                while len(cache) > RESPONSE_CACHE_SIZE:
+                    cache.popitem(last=False)
+        return Response(body, mimetype='application/json')
+    return inner
+
+
+def conditional(function):
+    """Marks response of wrapped user view with Last-Modified and ETag
+    headers based on DATA_CSV modification time and answers conditional
+    requests with 304 Not Modified.
+    """
+    @wraps(function)
+    def inner(user_id):
+        """This docstring will be overridden by @wraps decorator."""
+        mtime = get_data_mtime()
+        response = function(user_id)
+        response.last_modified = datetime.utcfromtimestamp(mtime)
+        response.set_etag('{0:d}-{1}'.format(int(mtime * 1000000), user_id))
+        return response.make_conditional(request)
+    return inner
+
+
+def precomputed(function):
+    """Serves body of wrapped user view from JSON file written for every
+    user whenever DATA_CSV changes. Does nothing unless JSON_CACHE_DIR
+    is configured.
+    """
+    _PRECOMPUTED[function.__name__] = function
+
+    @wraps(function)
+    def inner(user_id):
+        """This docstring will be overridden by @wraps decorator."""
+        directory = app.config.get('JSON_CACHE_DIR')
+        if not directory:
+            return function(user_id)
+        path = os.path.join(directory, function.__name__, '%d.json' % user_id)
+        try:
+            export_json(directory)
+            if not os.path.isfile(path) and user_id in get_data():
+                # files were removed by someone else, write them again
+                export_json(directory, force=True)
+            if (os.path.isfile(path) and
+                    os.path.getmtime(path) >= get_data_mtime()):
+                response = send_file(
+                    path, mimetype='application/json',
+                    cache_timeout=0, add_etags=False,
+                )
+                # caching headers are left to conditional, like for
+                # responses built by the view itself
+                response.headers.pop('Cache-Control', None)
+                response.headers.pop('Expires', None)
+                return response
+        except (IOError, OSError):
+            log.error(
+                'Cannot serve precomputed %s for user %d',
+                function.__name__, user_id, exc_info=True,
+            )
+        return function(user_id)
+    return inner
+
+
+def cache_by_mtime(function):
+    """Memoizes result of wrapped function until DATA_CSV file changes.
+    Cache key consists of file path and its modification time.
+    """
+    @wraps(function)
+    def inner():
+        """This docstring will be overridden by @wraps decorator."""
+        key = (function.__name__, app.config['DATA_CSV'], get_data_mtime())
+        try:
+            return _CACHE[key]
+        except KeyError:
+            pass
+        with _CACHE_LOCK:
+            if key not in _CACHE:
+                result = function()
+                # drop results computed for previous versions of the file
+                for old_key in _CACHE.keys():
+                    if old_key[0] == key[0]:
+                        del _CACHE[old_key]
+                _CACHE[key] = result
+            return _CACHE[key]
+    return inner
+
+
+class UserPresence(Mapping):
+    """Presence entries of single user stored as parallel arrays sorted
+    by date: date ordinals, weekdays and start, end seconds since midnight.
+    Behaves like read-only mapping of datetime.date to
+    {'start': datetime.time, 'end': datetime.time} dictionaries.
+    """
+
+    def __init__(self, entries):
+        """Takes iterable of (date, start seconds, end seconds) tuples."""
+        self.days = array('i')
+        self.weekdays = array('b')
+        self.starts = array('i')
+        self.ends = array('i')
+        for day, start, end in sorted(entries):
+            self.days.append(day.toordinal())
+            self.weekdays.append(day.weekday())
+            self.starts.append(start)
+            self.ends.append(end)
+
+    def __getitem__(self, day):
+        try:
+            ordinal = day.toordinal()
+        except AttributeError:
+            raise KeyError(day)
+        position = bisect_left(self.days, ordinal)
+        if position == len(self.days) or self.days[position] != ordinal:
+            raise KeyError(day)
+        return {
+            'start': seconds_to_time(self.starts[position]),
+            'end': seconds_to_time(self.ends[position]),
+        }
+
+    def __iter__(self):
+        return (date.fromordinal(ordinal) for ordinal in self.days)
+
+    def __len__(self):
+        return len(self.days)
+
+
+@cache_by_mtime
 def get_data():
     """Extracts presence data from CSV file and groups it by user_id.
     It creates structure like this:
     data = {
-        'user_id': {
+        'user_id': UserPresence({
             datetime.date(2013, 10, 1): {
                 'start': datetime.time(9, 0, 0),
                 'end': datetime.time(17, 30, 0),
@@ -41,36 +224,261 @@ def get_data():
                 'start': datetime.time(8, 30, 0),
                 'end': datetime.time(16, 45, 0),
             },
-        }
+        })
     }
     """
+    path = app.config['DATA_CSV']
+    # forking worker processes from threads serving requests may deadlock
+    # them, so parallel parsing is only done when preloading data
+    if app.config.get('PARALLEL_PARSE') and not has_request_context():
+        return parse_parallel(path)
+    with open(path, 'r') as csvfile:
+        return parse_presence(csvfile)
+
+
+def parse_presence(lines):
+    """Parses presence CSV lines into structure returned by get_data()."""
+    return freeze_presence(parse_rows(lines))
+
+
+def parse_rows(lines, first_line=0):
+    """Parses presence CSV lines into {user_id: {date: (start, end)}}
+    dictionary with start and end given in seconds since midnight.
+    Line numbers in log messages start at first_line.
+    """
     data = {}
-    with open(app.config['DATA_CSV'], 'r') as csvfile:
-        presence_reader = csv.reader(csvfile, delimiter=',')
-        for i, row in enumerate(presence_reader):
-            if len(row) != 4:
-                # ignore header and footer lines
-                continue
-
-            try:
-                user_id = int(row[0])
-                date = datetime.strptime(row[1], '%Y-%m-%d').date()
-                start = datetime.strptime(row[2], '%H:%M:%S').time()
-                end = datetime.strptime(row[3], '%H:%M:%S').time()
-            except (ValueError, TypeError):
-                log.debug('Problem with line %d: ', i, exc_info=True)
-
-            data.setdefault(user_id, {})[date] = {'start': start, 'end': end}
+    presence_reader = csv.reader(lines, delimiter=',')
+    for i, row in enumerate(presence_reader, first_line):
+        if len(row) != 4:
+            # ignore header and footer lines
+            continue
+
+        try:
+            user_id = int(row[0])
+            day = parse_date(row[1])
+            start = parse_seconds(row[2])
+            end = parse_seconds(row[3])
+        except (ValueError, TypeError):
+            log.debug('Problem with line %d: ', i, exc_info=True)
+            continue
+
+        data.setdefault(user_id, {})[day] = (start, end)
     return data
 
 
+def freeze_presence(data):
+    """Converts parsed rows of every user into UserPresence."""
+    return dict(
+        (user_id, UserPresence(
+            (day, start, end) for day, (start, end) in items.iteritems()
+        ))
+        for user_id, items in data.iteritems()
+    )
+
+
+def parse_date(text):
+    """Parses date in YYYY-MM-DD format without going through strptime."""
+    year, month, day = text.split('-')
+    if not (
+        len(year) == 4 and 1 <= len(month) <= 2 and 1 <= len(day) <= 2 and
+        year.isdigit() and month.isdigit() and day.isdigit()
+    ):
+        raise ValueError('Invalid date: {0!r}'.format(text))
+    return date(int(year), int(month), int(day))
+
+
+def parse_seconds(text):
+    """Parses time in HH:MM:SS format into amount of seconds since midnight
+    using integer arithmetic only.
+    """
+    parts = text.split(':')
+    if len(parts) != 3 or not all(
+            1 <= len(part) <= 2 and part.isdigit() for part in parts
+    ):
+        raise ValueError('Invalid time: {0!r}'.format(text))
+    hours, minutes, seconds = [int(part) for part in parts]
+    if not (hours < 24 and minutes < 60 and seconds < 60):
+        raise ValueError('Invalid time: {0!r}'.format(text))
+    return hours * 3600 + minutes * 60 + seconds
+
+
+def read_range(path, low, high):
+    """Reads lines of file which start within [low, high) byte range."""
+    lines = []
+    with open(path, 'r') as csvfile:
+        if low > 0:
+            # skip line started in previous range
+            csvfile.seek(low - 1)
+            csvfile.readline()
+        while csvfile.tell() < high:
+            line = csvfile.readline()
+            if not line:
+                break
+            lines.append(line)
+    return lines
+
+
+def split_ranges(path, parts):
+    """Splits file into about equal byte ranges starting at line beginnings.
+    Returns list of (low, high, number of lines before low) tuples.
+    """
+    size = os.path.getsize(path)
+    step = size // parts + 1
+    ranges = []
+    low = line = 0
+    with open(path, 'r') as csvfile:
+        while low < size:
+            # move range end to the beginning of the following line
+            csvfile.seek(low + step - 1)
+            csvfile.readline()
+            high = min(csvfile.tell(), size)
+            csvfile.seek(low)
+            ranges.append((low, high, line))
+            line += csvfile.read(high - low).count('\n')
+            low = high
+    return ranges
+
+
+def _parse_range(args):
+    """Parses presence entries from byte range of CSV file."""
+    path, low, high, first_line = args
+    return parse_rows(read_range(path, low, high), first_line)
+
+
+def parse_parallel(path, processes=None):
+    """Parses presence CSV file split into byte ranges in worker processes.
+    Returns the same structure as get_data(). Must not be called while
+    other threads are running.
+    """
+    processes = processes or multiprocessing.cpu_count()
+    ranges = [
+        (path, low, high, first_line)
+        for low, high, first_line in split_ranges(path, processes)
+    ]
+    pool = multiprocessing.Pool(processes)
+    try:
+        chunks = pool.map(_parse_range, ranges)
+    finally:
+        pool.close()
+        pool.join()
+
+    data = {}
+    for chunk in chunks:
+        for user_id, items in chunk.iteritems():
+            data.setdefault(user_id, {}).update(items)
+    return freeze_presence(data)
+
+
+@cache_by_mtime
+def get_stats():
+    """Precomputes presence statistics of every user used by views.
+    It creates structure like this:
+    stats = {
+        'user_id': {
+            'weekday': [0, 30047, 24465, 23705, 0, 0, 0],
+            'mean_weekday': [0, 30047.0, 24465.0, 23705.0, 0, 0, 0],
+            'start_end': [[0, 0], [34745, 64792], ..., [0, 0]],
+        }
+    }
+    """
+    stats = {}
+    for user_id, items in get_data().iteritems():
+        aggregates = aggregate_user(items)
+        stats[user_id] = {
+            'weekday': aggregates['sums'],
+            'mean_weekday': means(aggregates['sums'], aggregates['counts']),
+            'start_end': start_end_means(aggregates),
+        }
+    return stats
+
+
+@cache_by_mtime
+def get_users_json():
+    """Serializes users listing once per DATA_CSV version."""
+    return _JSON_ENCODER.encode([
+        {'user_id': user_id, 'name': 'User %d' % user_id}
+        for user_id in get_data()
+    ])
+
+
+def export_json(directory, force=False):
+    """Writes body of every precomputed view for every user into
+    <directory>/<view name>/<user_id>.json files, unless they were already
+    written for current version of DATA_CSV. Files of users missing
+    from DATA_CSV are removed.
+    """
+    version = (app.config['DATA_CSV'], get_data_mtime())
+    if not force and _EXPORTED.get(directory) == version:
+        return
+    with _CACHE_LOCK:
+        if not force and _EXPORTED.get(directory) == version:
+            return
+        _EXPORTED.pop(directory, None)
+        file_names = set('%d.json' % user_id for user_id in get_data())
+        for name, function in _PRECOMPUTED.iteritems():
+            view_directory = os.path.join(directory, name)
+            if not os.path.isdir(view_directory):
+                os.makedirs(view_directory)
+            for file_name in os.listdir(view_directory):
+                if file_name not in file_names:
+                    os.remove(os.path.join(view_directory, file_name))
+            for user_id in get_data():
+                body = function(user_id).get_data()
+                # write to temporary file first, so no request sees
+                # partial file
+                with tempfile.NamedTemporaryFile(
+                    dir=view_directory, delete=False
+                ) as json_file:
+                    json_file.write(body)
+                os.chmod(json_file.name, 0o644)
+                os.rename(
+                    json_file.name,
+                    os.path.join(view_directory, '%d.json' % user_id),
+                )
+        _EXPORTED[directory] = version
+
+
+def aggregate_user(items):
+    """Sums up presence intervals, start and end times and counts entries
+    by weekday in a single pass over user presence arrays.
+    """
+    # one slot for every day in week
+    sums = [0] * 7
+    starts = [0] * 7
+    ends = [0] * 7
+    counts = [0] * 7
+    for weekday, start, end in izip(items.weekdays, items.starts, items.ends):
+        sums[weekday] += end - start
+        starts[weekday] += start
+        ends[weekday] += end
+        counts[weekday] += 1
+    return {'sums': sums, 'starts': starts, 'ends': ends, 'counts': counts}
+
+
+def means(totals, counts):
+    """Divides totals by counts. Returns zero where count is zero."""
+    return [
+        float(total) / count if count else 0
+        for total, count in zip(totals, counts)
+    ]
+
+
+def start_end_means(aggregates):
+    """Calculates mean start and end time by weekday from aggregates."""
+    return [
+        [start, end]
+        for start, end in zip(
+            means(aggregates['starts'], aggregates['counts']),
+            means(aggregates['ends'], aggregates['counts']),
+        )
+    ]
+
+
 def group_by_weekday(items):
     """Groups presence entries by weekday."""
     result = [[], [], [], [], [], [], []]  # one list for every day in week
-    for date in items:
-        start = items[date]['start']
-        end = items[date]['end']
-        result[date.weekday()].append(interval(start, end))
+    for weekday, start, end in izip(items.weekdays, items.starts, items.ends):
+        result[weekday].append(end - start)
     return result
 
 
@@ -79,6 +487,11 @@ def seconds_since_midnight(time):
     return time.hour * 3600 + time.minute * 60 + time.second
 
 
+def seconds_to_time(seconds):
+    """Converts amount of seconds since midnight to datetime.time."""
+    return (datetime.min + timedelta(seconds=seconds)).time()
+
+
 def interval(start, end):
     """Calculates inverval in seconds between two datetime.time objects."""
     return seconds_since_midnight(end) - seconds_since_midnight(start)
@@ -91,15 +504,4 @@ def mean(items):
 
 def group_by_start_end_time(items):
     """Groups start, end time by weekday."""
-    result = [[], [], [], [], [], [], []]  # one list for every day in week
-    time = [{'start': [], 'end': []} for i in range(7)]
-    for date in items:
-        time[date.weekday()]['start'].append(
-            seconds_since_midnight(items[date]['start'])
-        )
-        time[date.weekday()]['end'].append(
-            seconds_since_midnight(items[date]['end'])
-        )
-    for weekday, values in enumerate(time):
-        result[weekday] = [mean(values['start']), mean(values['end'])]
-    return result
+    return start_end_means(aggregate_user(items))
@@ -2,20 +2,23 @@
 """Defines views."""
 
 import calendar
-from flask import redirect, abort
+from flask import Response, redirect, abort
 
 from presence_analyzer.main import app
 from presence_analyzer.utils import (
     jsonify,
-    get_data,
-    mean,
-    group_by_weekday,
-    group_by_start_end_time,
+    conditional,
+    precomputed,
+    cache_response,
+    get_stats,
+    get_users_json,
 )
 
 import logging
 log = logging.getLogger(__name__)  # pylint: disable=invalid-name
 
+_DAY_ABBR = tuple(calendar.day_abbr)
+
 
 @app.route('/')
 def mainpage():
@@ -24,46 +27,45 @@ def mainpage():
 
 
 @app.route('/api/v1/users', methods=['GET'])
-@jsonify
 def users_view():
     """Users listing for dropdown."""
-    data = get_data()
-    return [
-        {'user_id': i, 'name': 'User {0}'.format(str(i))}
-        for i in data.keys()
-    ]
+    return Response(get_users_json(), mimetype='application/json')
 
 
 @app.route('/api/v1/mean_time_weekday/<int:user_id>', methods=['GET'])
+@conditional
+@precomputed
+@cache_response
 @jsonify
 def mean_time_weekday_view(user_id):
     """Returns mean presence time of given user grouped by weekday."""
-    data = get_data()
-    if user_id not in data:
+    user_stats = get_stats().get(user_id)
+    if user_stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
     result = [
-        (calendar.day_abbr[weekday], mean(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        (_DAY_ABBR[weekday], mean_time)
+        for weekday, mean_time in enumerate(user_stats['mean_weekday'])
     ]
     return result
 
 
 @app.route('/api/v1/presence_weekday/<int:user_id>', methods=['GET'])
+@conditional
+@precomputed
+@cache_response
 @jsonify
 def presence_weekday_view(user_id):
     """Returns total presence time of given user grouped by weekday."""
-    data = get_data()
-    if user_id not in data:
+    user_stats = get_stats().get(user_id)
+    if user_stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_weekday(data[user_id])
     result = [
-        (calendar.day_abbr[weekday], sum(intervals))
-        for weekday, intervals in enumerate(weekdays)
+        (_DAY_ABBR[weekday], total)
+        for weekday, total in enumerate(user_stats['weekday'])
     ]
 
     result.insert(0, ('Weekday', 'Presence (s)'))
@@ -71,16 +73,18 @@ def presence_weekday_view(user_id):
 
 
 @app.route('/api/v1/presence_start_end/<int:user_id>', methods=['GET'])
+@conditional
+@precomputed
+@cache_response
 @jsonify
 def presence_start_end_time(user_id):
     """Returns start and end time of given user grouped by weekday."""
-    data = get_data()
-    if user_id not in data:
+    user_stats = get_stats().get(user_id)
+    if user_stats is None:
         log.debug('User %s not found!', user_id)
         abort(404)
 
-    weekdays = group_by_start_end_time(data[user_id])
     return [
-        (calendar.day_abbr[weekday], start, end)
-        for weekday, (start, end) in enumerate(weekdays)
+        (_DAY_ABBR[weekday], start, end)
+        for weekday, (start, end) in enumerate(user_stats['start_end'])
     ]